@@ -1,18 +1,48 @@
 from abc import ABCMeta, abstractmethod
-from typing import Callable, Dict, List, Optional, Tuple
+from typing import Callable, Dict, Iterator, List, Mapping, Optional, Tuple, Type
 
 import ConfigSpace as CS
 
 import numpy as np
 
-from parzen_estimator import (
-    MultiVariateParzenEstimator,
-    ParzenEstimatorType,
-    build_categorical_parzen_estimator,
-    build_numerical_parzen_estimator,
+from parzen_estimator import CategoricalParzenEstimator, build_categorical_parzen_estimator
+
+from optimizers.tpe.utils.batched_parzen_estimator import (
+    BatchedMultiVariateParzenEstimator,
+    build_numerical_parzen_estimators,
+    get_numerical_parameters,
 )
+from optimizers.tpe.utils.buffer_utils import reserve_columns
+from optimizers.tpe.utils.constants import CategoricalHPType, LOG_PDF_CHUNK_SIZE, NumericType, config2type
+
+
+_NUMERICAL, _ORDINAL, _CATEGORICAL = 0, 1, 2
+_HP_KIND_OF = {"OrdinalHyperparameter": _ORDINAL, "CategoricalHyperparameter": _CATEGORICAL}
+
+
+class _ObservationsView(Mapping[str, np.ndarray]):
+    def __init__(self, owner: "BaseTPE", row_of: Dict[str, int]):
+        """
+        A read-only dict-like view of the observations without copying each row.
+        The rows are always read from the latest obs_matrix of owner as it is reallocated when it grows.
+
+        Attributes:
+            owner (BaseTPE): The TPE that stores the observations in obs_matrix.
+            row_of (Dict[str, int]): The row index of each name in obs_matrix.
+        """
+        self._owner = owner
+        self._row_of = row_of
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        vals = self._owner._obs_matrix[self._row_of[name], :self._owner._n_observations]
+        vals.flags.writeable = False
+        return vals
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._row_of)
 
-from optimizers.tpe.utils.constants import NumericType, config2type
+    def __len__(self) -> int:
+        return len(self._row_of)
 
 
 class AbstractTPE(metaclass=ABCMeta):
@@ -51,23 +81,39 @@ class BaseTPE(AbstractTPE, metaclass=ABCMeta):
         min_bandwidth_factor: float,
         top: float,
         minimize: Optional[Dict[str, bool]],
+        fast_math: bool = False,
     ):
         """
         Attributes:
-            rng (np.random.RandomState): random state to maintain the reproducibility
+            rng (np.random.Generator): random number generator to maintain the reproducibility
             n_ei_candidates (int): The number of samplings to optimize the EI value
             config_space (CS.ConfigurationSpace): The searching space of the task
             hp_names (List[str]): The list of hyperparameter names
             objective_names (List[str]): The names of the metrics (or objective functions)
             runtime_name (str): The name of the runtime metric.
-            observations (Dict[str, Any]): The storage of the observations
-            sorted_observations (Dict[str, Any]): The storage of the observations sorted based on loss
+            obs_matrix (np.ndarray):
+                The storage of the observations in the order of evaluations.
+                The rows follow row_of and the last row is the runtime.
+                The shape is (n_dims + n_objectives + 1, capacity) and only [:, :size] is valid.
+            n_observations (int): The number of observations.
+            sorted_observations (np.ndarray):
+                The observations of hyperparameters and objectives sorted based on loss.
+                The shape is (n_dims + n_objectives, capacity) and only [:, :size] is valid.
+            row_of (Dict[str, int]): The row index of each hyperparameter or objective in sorted_observations
+            observations_view (_ObservationsView): The read-only view of obs_matrix including the runtime.
             min_bandwidth_factor (float): The minimum bandwidth for numerical parameters
             top (float): The hyperparam of the cateogircal kernel. It defines the prob of the top category.
-            is_categoricals (Dict[str, bool]): Whether the given hyperparameter is categorical
-            is_ordinals (Dict[str, bool]): Whether the given hyperparameter is ordinal
+            choices (Dict[str, np.ndarray]): The choices of each categorical parameter
+            choice_to_index (Dict[str, Dict[Any, int]]):
+                The index of each choice. Categorical parameters are stored as the indices.
+            hp_configs (List[HPType]): The hyperparameter information in the order of hp_names
+            hp_kinds (np.ndarray): The kind of each hyperparameter, i.e. numerical (0), ordinal (1) or categorical (2)
+            hp_dtypes (Dict[str, Type[np.number]]):
+                The dtype of each hyperparameter in observations. Categorical parameters use that of the indices.
+            fast_math (bool):
+                Whether to use the logistic approximation of the normal cdf for discrete parameters in log_pdf.
         """
-        self._rng = np.random.RandomState(seed)
+        self._rng = np.random.default_rng(seed)
         self._n_ei_candidates = n_ei_candidates
         self._config_space = config_space
         self._hp_names = list(config_space._hyperparameters.keys())
@@ -77,28 +123,50 @@ class BaseTPE(AbstractTPE, metaclass=ABCMeta):
         self._percentile = 0.0
         self._min_bandwidth_factor = min_bandwidth_factor
         self._top = top
+        self._fast_math = fast_math
         self._minimize = {
             obj_name: True if minimize is None else minimize.get(obj_name, True) for obj_name in self._objective_names
         }
 
-        self._observations: Dict[str, np.ndarray] = {hp_name: np.array([]) for hp_name in self._hp_names}
-        self._sorted_observations: Dict[str, np.ndarray] = {hp_name: np.array([]) for hp_name in self._hp_names}
-        self._observations.update({objective_name: np.array([]) for objective_name in objective_names})
-        self._sorted_observations.update({objective_name: np.array([]) for objective_name in objective_names})
-        self._observations[self._runtime_name] = np.array([])
-        self._sorted_observations[self._runtime_name] = np.array([])
+        self._row_of = {name: row for row, name in enumerate(self._hp_names + self._objective_names)}
+        self._runtime_row = len(self._row_of)
+        self._obs_matrix = np.empty((len(self._row_of) + 1, 0), dtype=np.float64)
+        self._n_observations = 0
+        self._sorted_observations = np.empty((len(self._row_of), 0), dtype=np.float64)
+        self._observations_view = _ObservationsView(
+            owner=self, row_of={**self._row_of, self._runtime_name: self._runtime_row}
+        )
 
-        self._is_categoricals = {
-            hp_name: self._config_space.get_hyperparameter(hp_name).__class__.__name__ == "CategoricalHyperparameter"
-            for hp_name in self._hp_names
+        self._hp_configs = [self._config_space.get_hyperparameter(hp_name) for hp_name in self._hp_names]
+        self._hp_kinds = np.array(
+            [_HP_KIND_OF.get(config.__class__.__name__, _NUMERICAL) for config in self._hp_configs], dtype=np.int8
+        )
+        # The row of each hyperparameter in obs_matrix is identical to its index in hp_names
+        self._categorical_rows: List[int] = np.flatnonzero(self._hp_kinds == _CATEGORICAL).tolist()
+        self._choices = {
+            self._hp_names[row]: np.asarray(self._hp_configs[row].choices) for row in self._categorical_rows
         }
-
-        self._is_ordinals = {
-            hp_name: self._config_space.get_hyperparameter(hp_name).__class__.__name__ == "OrdinalHyperparameter"
-            for hp_name in self._hp_names
+        self._choice_to_index = {
+            hp_name: {choice: idx for idx, choice in enumerate(choices)} for hp_name, choices in self._choices.items()
         }
-        self._mvpe_lower: MultiVariateParzenEstimator
-        self._mvpe_upper: MultiVariateParzenEstimator
+        # obs_matrix is float64 for the vectorized computation, but the public observations are typed per parameter
+        self._hp_dtypes: Dict[str, Type[np.number]] = {
+            hp_name: np.int64 if config2type.get(config.__class__.__name__) is int else np.float64
+            for hp_name, config in zip(self._hp_names, self._hp_configs)
+        }
+        self._hp_dtypes.update({hp_name: np.int32 for hp_name in self._choices.keys()})
+        # Numerical parameters share the kernel structure, so we build their Parzen estimators at once
+        self._numerical_rows = np.flatnonzero(self._hp_kinds != _CATEGORICAL)
+        self._numerical_hp_names = [self._hp_names[row] for row in self._numerical_rows]
+        self._numerical_params = get_numerical_parameters(
+            configs=[self._hp_configs[row] for row in self._numerical_rows],
+            is_ordinals=(self._hp_kinds[self._numerical_rows] == _ORDINAL).tolist(),
+            default_min_bandwidth_factor=min_bandwidth_factor,
+        )
+        self._mvpe_lower: BatchedMultiVariateParzenEstimator
+        self._mvpe_upper: BatchedMultiVariateParzenEstimator
+        self._log_gamma: float
+        self._log_gamma_ratio: float
         self._order: np.ndarray
 
     @abstractmethod
@@ -112,16 +180,27 @@ class BaseTPE(AbstractTPE, metaclass=ABCMeta):
     def apply_knowledge_augmentation(
         self, observations: Dict[str, np.ndarray], percentile_func: Optional[Callable] = None
     ) -> None:
-        if any(self._observations[objective_name].size != 0 for objective_name in self._objective_names):
+        if self._n_observations != 0:
             raise ValueError("Knowledge augmentation must be applied before the optimization.")
         if any(objective_name not in observations for objective_name in self._objective_names):
             raise ValueError("All objectives must be provided for when applying knowledge augmentation")
 
-        self._observations.update({name: vals.copy() for name, vals in observations.items()})
+        n_observations = observations[self._objective_names[0]].size
+        self._obs_matrix = np.empty((self._runtime_row + 1, max(16, 2 * n_observations)), dtype=np.float64)
+        self._obs_matrix[:self._runtime_row, :n_observations] = [
+            [self._choice_to_index[name][val] for val in observations[name]]
+            if name in self._choice_to_index
+            else observations[name]
+            for name in self._row_of.keys()
+        ]
+        self._obs_matrix[self._runtime_row, :n_observations] = observations.get(self._runtime_name, np.nan)
+
+        self._n_observations = n_observations
         order = self._calculate_order()
-        self._sorted_observations.update({name: observations[name][order] for name in observations.keys()})
+        self._sorted_observations = np.empty((self._runtime_row, self._obs_matrix.shape[1]), dtype=np.float64)
+        self._sorted_observations[:, :n_observations] = self._obs_matrix[:self._runtime_row, order]
+
         self._n_lower = self._percentile_func() if percentile_func is None else percentile_func()
-        n_observations = self._observations[self._objective_names[0]].size
         self._percentile = self._n_lower / n_observations
         self._update_parzen_estimators()
 
@@ -140,57 +219,153 @@ class BaseTPE(AbstractTPE, metaclass=ABCMeta):
             results (Dict[str, float]): The dict of loss values.
             runtime (float): The runtime for both sampling and training
         """
-        order = self._calculate_order(results)
+        prev_n_lower = self._n_lower
+        idx = self._store_observations(eval_config=eval_config, results=results)
+        self._n_lower = self._percentile_func() if percentile_func is None else percentile_func()
+        self._percentile = self._n_lower / self.size
 
-        for objective_name in self._objective_names:
-            metric_val = results[0][objective_name]
-            self._observations[objective_name] = np.append(self._observations[objective_name], metric_val)
-            self._sorted_observations[objective_name] = self._observations[objective_name][order]
-
-        for hp_name in self._hp_names:
-            hp_val = eval_config[hp_name]
-            self._observations[hp_name] = np.append(self._observations[hp_name], hp_val)
-            self._sorted_observations[hp_name] = self._observations[hp_name][order]
+        if idx is None or self.size == 1:
+            self._update_parzen_estimators()
+        elif self._n_lower == prev_n_lower and idx >= self._n_lower:
+            # The new observation joined the upper group and no observation crossed the split
+            self._update_parzen_estimators(update_lower=False)
+        elif self._n_lower == prev_n_lower + 1 and idx < self._n_lower:
+            # The new observation joined the lower group and the upper group did not lose any observation
+            self._update_parzen_estimators(update_upper=False)
         else:
-            self._n_lower = self._percentile_func() if percentile_func is None else percentile_func()
-            self._percentile = self._n_lower / self._observations[self._objective_names[0]].size
             self._update_parzen_estimators()
-            self._observations[self._runtime_name] = np.append(self._observations[self._runtime_name], runtime)
-
-    def _update_parzen_estimators(self) -> None:
-        n_lower = self._n_lower
-        pe_lower_dict: Dict[str, ParzenEstimatorType] = {}
-        pe_upper_dict: Dict[str, ParzenEstimatorType] = {}
-        for hp_name in self._hp_names:
-            is_categorical = self._is_categoricals[hp_name]
-            sorted_observations = self._sorted_observations[hp_name]
-
-            # split observations
-            lower_vals = sorted_observations[:n_lower]
-            upper_vals = sorted_observations[n_lower:]
-
-            pe_lower_dict[hp_name], pe_upper_dict[hp_name] = self._get_parzen_estimator(
-                lower_vals=lower_vals,
-                upper_vals=upper_vals,
-                hp_name=hp_name,
-                is_categorical=is_categorical,
+
+        self._obs_matrix[self._runtime_row, self._n_observations - 1] = runtime
+
+    def _encode_observation(self, eval_config: Dict[str, NumericType], results: Dict[str, float]) -> np.ndarray:
+        """
+        Convert a new observation into a column of sorted_observations.
+
+        Args:
+            eval_config (Dict[str, NumericType]): The configuration to evaluate (after conversion)
+            results (Dict[str, float]): The dict of loss values.
+
+        Returns:
+            new_col (np.ndarray):
+                The new observation with the shape of (n_dims + n_objectives, ).
+                Categorical parameters are converted into the indices of the choices.
+        """
+        new_col = np.empty(len(self._row_of), dtype=np.float64)
+        new_col[self._numerical_rows] = [eval_config[hp_name] for hp_name in self._numerical_hp_names]
+        for row in self._categorical_rows:
+            hp_name = self._hp_names[row]
+            new_col[row] = self._choice_to_index[hp_name][eval_config[hp_name]]
+        for objective_name in self._objective_names:
+            new_col[self._row_of[objective_name]] = results[0][objective_name]
+
+        return new_col
+
+    def _fetch_observations(self, name: str) -> np.ndarray:
+        """
+        Return the observations of name in the order of evaluations without copying.
+
+        Args:
+            name (str): The name of a hyperparameter or an objective.
+
+        Returns:
+            vals (np.ndarray): The view of the row in obs_matrix.
+        """
+        return self._obs_matrix[self._row_of[name], :self._n_observations]
+
+    def _append_observations(self, new_col: np.ndarray) -> None:
+        size = self._n_observations
+        self._obs_matrix = reserve_columns(self._obs_matrix, size)
+        self._obs_matrix[:self._runtime_row, size] = new_col
+        self._obs_matrix[self._runtime_row, size] = np.nan  # runtime is filled at the end of update_observations
+        self._n_observations += 1
+
+    def _store_observations(self, eval_config: Dict[str, NumericType], results: Dict[str, float]) -> Optional[int]:
+        """
+        Append the new observation and re-sort all the observations.
+        Child classes can override it if the sorted observations can be updated incrementally.
+
+        Args:
+            eval_config (Dict[str, NumericType]): The configuration to evaluate (after conversion)
+            results (Dict[str, float]): The dict of loss values.
+
+        Returns:
+            idx (Optional[int]):
+                The column index of the new observation in sorted_observations.
+                None if the other columns might be reordered as well.
+        """
+        order = self._calculate_order(results)
+        self._append_observations(self._encode_observation(eval_config=eval_config, results=results))
+        size = order.size
+        self._sorted_observations = reserve_columns(self._sorted_observations, size - 1)
+        self._sorted_observations[:, :size] = self._obs_matrix[:self._runtime_row, order]
+
+        return None
+
+    def _update_parzen_estimators(self, update_lower: bool = True, update_upper: bool = True) -> None:
+        """
+        Rebuild the Parzen estimators of the groups whose observations changed.
+
+        Args:
+            update_lower (bool): Whether to rebuild the estimator of the lower group.
+            update_upper (bool): Whether to rebuild the estimator of the upper group.
+        """
+        if update_lower:
+            self._mvpe_lower = self._build_parzen_estimator(start=0, end=self._n_lower)
+        if update_upper:
+            self._mvpe_upper = self._build_parzen_estimator(start=self._n_lower, end=self.size)
+
+        # The constants of compute_probability_improvement depend only on the percentile
+        EPS = 1e-12
+        self._log_gamma = float(np.log(self._percentile + EPS))
+        self._log_gamma_ratio = float(np.log(1.0 - self._percentile + EPS)) - self._log_gamma
+
+    def _build_parzen_estimator(self, start: int, end: int) -> BatchedMultiVariateParzenEstimator:
+        """
+        Build the Parzen estimator given the sorted observations in [start, end).
+
+        Args:
+            start (int): The first column of the group in sorted_observations.
+            end (int): The end column (exclusive) of the group in sorted_observations.
+
+        Returns:
+            mvpe (BatchedMultiVariateParzenEstimator): The Parzen estimator of the group.
+        """
+        numerical_pe = None
+        if len(self._numerical_hp_names) > 0:
+            numerical_pe = build_numerical_parzen_estimators(
+                params=self._numerical_params,
+                vals=self._sorted_observations[self._numerical_rows, start:end],
+                fast_math=self._fast_math,
             )
 
-        self._mvpe_lower = MultiVariateParzenEstimator(pe_lower_dict)
-        self._mvpe_upper = MultiVariateParzenEstimator(pe_upper_dict)
+        categorical_pes: Dict[str, CategoricalParzenEstimator] = {
+            self._hp_names[row]: self._get_categorical_parzen_estimator(
+                vals=self._sorted_observations[row, start:end], config=self._hp_configs[row]
+            )
+            for row in self._categorical_rows
+        }
 
-    def get_config_candidates(self) -> Dict[str, np.ndarray]:
+        return BatchedMultiVariateParzenEstimator(
+            param_names=self._hp_names,
+            numerical_param_names=self._numerical_hp_names,
+            numerical_pe=numerical_pe,
+            categorical_pes=categorical_pes,
+        )
+
+    def get_config_candidates(self, n_samples: Optional[int] = None) -> Dict[str, np.ndarray]:
         """
         Since we compute the probability improvement of each objective independently,
         we need to sample the configurations in advance.
 
+        Args:
+            n_samples (Optional[int]): The number of candidates. If None, n_ei_candidates is used.
+
         Returns:
             config_cands (Dict[str, np.ndarray]):
                 A dict of arrays of candidates in each dimension
         """
-        return self._mvpe_lower.sample(
-            n_samples=self._n_ei_candidates, rng=self._rng, dim_independent=True, return_dict=True
-        )
+        n_samples = self._n_ei_candidates if n_samples is None else n_samples
+        return self._mvpe_lower.sample(n_samples=n_samples, rng=self._rng)
 
     def compute_config_loglikelihoods(self, config_cands: Dict[str, np.ndarray]) -> Tuple[np.ndarray, np.ndarray]:
         """
@@ -207,9 +382,20 @@ class BaseTPE(AbstractTPE, metaclass=ABCMeta):
                 The loglikelihoods of each configuration in
                 the good group or bad group.
                 The shape is (n_ei_candidates, ) for each.
+
+        Note:
+            The candidates are evaluated in chunks of LOG_PDF_CHUNK_SIZE
+            so that the intermediate arrays in log_pdf stay small.
         """
-        config_ll_lower = self._mvpe_lower.log_pdf(config_cands)
-        config_ll_upper = self._mvpe_upper.log_pdf(config_cands)
+        n_samples = config_cands[self._hp_names[0]].size
+        config_ll_lower, config_ll_upper = np.empty(n_samples), np.empty(n_samples)
+        for start in range(0, n_samples, LOG_PDF_CHUNK_SIZE):
+            chunk = slice(start, start + LOG_PDF_CHUNK_SIZE)
+            config_cands_chunk = {hp_name: vals[chunk] for hp_name, vals in config_cands.items()}
+            config_ll_lower[chunk], config_ll_upper[chunk] = self._mvpe_lower.log_pdf_pair(
+                self._mvpe_upper, config_cands_chunk
+            )
+
         return config_ll_lower, config_ll_upper
 
     def compute_probability_improvement(self, config_cands: Dict[str, np.ndarray]) -> np.ndarray:
@@ -231,62 +417,49 @@ class BaseTPE(AbstractTPE, metaclass=ABCMeta):
             In this implementation, we consider the gamma
                 (gamma + (1 - gamma)g(x)/l(x))^-1
                 = exp(log(gamma)) + exp(log(1 - gamma) + log(g(x)/l(x)))
+            and log(exp(a) + exp(b)) = a + log(1 + exp(b - a)) where log(1 + exp(d)) is computed as
+                max(d, 0) + log1p(exp(-|d|))
+            so that we need only one exp per candidate without overflow.
         """
-        EPS = 1e-12
         cll_lower, cll_upper = self.compute_config_loglikelihoods(config_cands)
-        first_term = np.log(self._percentile + EPS)
-        second_term = np.log(1.0 - self._percentile + EPS) + cll_upper - cll_lower
-        pi = -np.logaddexp(first_term, second_term)
+        diff = self._log_gamma_ratio + cll_upper - cll_lower
+        pi = -self._log_gamma - (np.maximum(diff, 0.0) + np.log1p(np.exp(-np.abs(diff))))
         return pi
 
-    def _get_parzen_estimator(
-        self,
-        lower_vals: np.ndarray,
-        upper_vals: np.ndarray,
-        hp_name: str,
-        is_categorical: bool,
-    ) -> Tuple[ParzenEstimatorType, ParzenEstimatorType]:
+    def _get_categorical_parzen_estimator(
+        self, vals: np.ndarray, config: CategoricalHPType
+    ) -> CategoricalParzenEstimator:
         """
-        Construct parzen estimators for the lower and the upper groups and return them
+        Construct the parzen estimator of a categorical parameter for one group and return it.
+        Numerical parameters are handled by build_numerical_parzen_estimators at once.
 
         Args:
-            lower_vals (np.ndarray): The array of the values in the lower group
-            upper_vals (np.ndarray): The array of the values in the upper group
-            hp_name (str): The name of the hyperparameter
-            is_categorical (bool): Whether the given hyperparameter is categorical
+            vals (np.ndarray): The array of the choice indices in the group
+            config (CategoricalHPType): The hyperparameter information
 
         Returns:
-            pe_lower (ParzenEstimatorType): The parzen estimator for the lower group
-            pe_upper (ParzenEstimatorType): The parzen estimator for the upper group
+            pe (CategoricalParzenEstimator): The parzen estimator for the group
         """
-        pe_lower: ParzenEstimatorType
-        pe_upper: ParzenEstimatorType
-
-        config = self._config_space.get_hyperparameter(hp_name)
-        config_type = config.__class__.__name__
-        is_ordinal = self._is_ordinals[hp_name]
-        kwargs = dict(config=config)
-
-        if is_categorical:
-            pe_lower = build_categorical_parzen_estimator(vals=lower_vals, **kwargs, top=self._top)
-            pe_upper = build_categorical_parzen_estimator(vals=upper_vals, **kwargs, top=self._top)
-        else:
-            kwargs.update(
-                dtype=config2type[config_type],
-                is_ordinal=is_ordinal,
-                default_min_bandwidth_factor=self._min_bandwidth_factor,
-            )
-            pe_lower = build_numerical_parzen_estimator(vals=lower_vals, **kwargs)
-            pe_upper = build_numerical_parzen_estimator(vals=upper_vals, **kwargs)
-
-        return pe_lower, pe_upper
+        return build_categorical_parzen_estimator(
+            config=config, vals=vals.astype(self._hp_dtypes[config.name]), top=self._top, vals_is_indices=True
+        )
 
     @property
     def size(self) -> int:
-        n_evals = self._observations[self._objective_names[0]].size
-        return n_evals
+        return self._n_observations
 
     @property
     def observations(self) -> Dict[str, np.ndarray]:
-        n_evals = self.size
-        return {hp_name: vals[-n_evals:].copy() for hp_name, vals in self._observations.items()}
+        """
+        The observations in the order of evaluations.
+        Float parameters, objectives and runtime are read-only views of the storage.
+        Integer parameters are returned as int64 and categorical parameters as the symbols.
+        """
+        observations = dict(self._observations_view)
+        for hp_name, dtype in self._hp_dtypes.items():
+            if dtype is not np.float64:
+                observations[hp_name] = observations[hp_name].astype(dtype)
+        for hp_name, choices in self._choices.items():
+            observations[hp_name] = choices[observations[hp_name]]
+
+        return observations
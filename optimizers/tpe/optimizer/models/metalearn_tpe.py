@@ -34,6 +34,7 @@ class MetaLearnTPE(AbstractTPE):
         # Until here
         constraints: Optional[Dict[str, float]] = None,
         n_samples: int = 1000,
+        fast_math: bool = False,
     ):
         if OBJECTIVE_KEY in metadata:
             raise KeyError(f"metadata cannot include the key name {OBJECTIVE_KEY}")
@@ -48,6 +49,7 @@ class MetaLearnTPE(AbstractTPE):
             min_bandwidth_factor=min_bandwidth_factor,
             top=top,
             minimize=minimize,
+            fast_math=fast_math,
         )
         self._quantile = quantile
         self._uniform_transform = uniform_transform
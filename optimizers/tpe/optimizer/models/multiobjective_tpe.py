@@ -24,6 +24,7 @@ class MultiObjectiveTPE(BaseTPE):
         minimize: Optional[Dict[str, bool]],
         # The control parameters for experiments
         quantile: float,
+        fast_math: bool = False,
     ):
         super().__init__(
             config_space=config_space,
@@ -34,27 +35,27 @@ class MultiObjectiveTPE(BaseTPE):
             min_bandwidth_factor=min_bandwidth_factor,
             top=top,
             minimize=minimize,
+            fast_math=fast_math,
         )
         self._n_fronts: int
         self._quantile = quantile
         self._nondominated_ranks: np.ndarray
 
     def _percentile_func(self) -> int:
-        n_observations = self._observations[self._objective_names[0]].size
-        return max(self._n_fronts, int(np.ceil(self._quantile * n_observations)))
+        return max(self._n_fronts, int(np.ceil(self._quantile * self._n_observations)))
 
     def _calculate_order(self, results: Optional[Dict[str, float]] = None) -> np.ndarray:
         with_new_result = results is not None
 
-        n_observations = self._observations[self._objective_names[0]].size
+        n_observations = self._n_observations
         n_objectives = len(self._objective_names)
         costs = np.zeros((n_observations + with_new_result, n_objectives))
         for idx, objective_name in enumerate(self._objective_names):
             if not with_new_result:
-                costs[:, idx] = self._observations[objective_name]
+                costs[:, idx] = self._fetch_observations(objective_name)
                 continue
             else:
-                costs[:-1, idx] = self._observations[objective_name]
+                costs[:-1, idx] = self._fetch_observations(objective_name)
 
             assert results is not None  # mypy redefinition
             new_loss = results.get(objective_name, None)
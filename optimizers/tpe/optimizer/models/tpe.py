@@ -1,10 +1,79 @@
-from typing import Dict, Optional
+import math
+from typing import Dict, Optional, Tuple
 
 import ConfigSpace as CS
 
 import numpy as np
 
 from optimizers.tpe.optimizer.models import BaseTPE
+from optimizers.tpe.utils._numba_utils import NUMBA_AVAILABLE, njit
+from optimizers.tpe.utils.batched_parzen_estimator import KernelArrays
+from optimizers.tpe.utils.buffer_utils import insert_and_sort, reserve_columns
+from optimizers.tpe.utils.constants import EPS, NumericType, SQR2
+from optimizers.tpe.utils.special_funcs import LOGISTIC_SCALE
+
+
+_CONTINUOUS_KERNEL, _DISCRETE_KERNEL, _CATEGORICAL_KERNEL = 0, 1, 2
+
+
+@njit(cache=True)
+def _log_pdf_impl(
+    X: np.ndarray,
+    kernel_kinds: np.ndarray,
+    categorical_index: np.ndarray,
+    lb: np.ndarray,
+    ub: np.ndarray,
+    half_q: np.ndarray,
+    kernels: KernelArrays,
+    fast_math: bool,
+) -> np.ndarray:
+    """
+    Compute the log density values of BatchedMultiVariateParzenEstimator sample by sample.
+    It gives the same values as log_pdf without allocating the (n_params, n_basis, n_samples) array.
+
+    Args:
+        X (np.ndarray): The data points with the shape of (n_params, n_samples). Categoricals are the indices.
+        kernel_kinds (np.ndarray): The kind of the kernel of each parameter, i.e. continuous, discrete or categorical.
+        categorical_index (np.ndarray): The index in kernels.categorical_blls of each categorical parameter.
+        lb, ub, half_q (np.ndarray): The bounds and the half of q for each discrete parameter.
+        kernels (KernelArrays): The kernels of the Parzen estimator.
+        fast_math (bool): Whether to use the logistic approximation of the normal cdf for discrete parameters.
+
+    Returns:
+        log_pdf_values (np.ndarray): The log density values with the shape of (n_samples, ).
+    """
+    n_params, n_samples = X.shape
+    n_basis = kernels.means.shape[1]
+    log_pdf_values = np.empty(n_samples)
+    blls = np.empty(n_basis)
+    for i in range(n_samples):
+        blls[:] = kernels.log_weight
+        for d in range(n_params):
+            x = X[d, i]
+            if kernel_kinds[d] == _CATEGORICAL_KERNEL:
+                c, t = int(x), categorical_index[d]
+                for k in range(n_basis):
+                    blls[k] += kernels.categorical_blls[t, k, c]
+            elif kernel_kinds[d] == _DISCRETE_KERNEL:
+                x_u, x_l = min(x + half_q[d], ub[d]), max(x - half_q[d], lb[d])
+                for k in range(n_basis):
+                    mean, std = kernels.means[d, k], kernels.stds[d, k]
+                    if fast_math:
+                        cdf_u = 0.5 * (1.0 + math.tanh(0.5 * LOGISTIC_SCALE * (x_u - mean) / std))
+                        cdf_l = 0.5 * (1.0 + math.tanh(0.5 * LOGISTIC_SCALE * (x_l - mean) / std))
+                    else:
+                        cdf_u = 0.5 * (1.0 + math.erf((x_u - mean) / (SQR2 * std)))
+                        cdf_l = 0.5 * (1.0 + math.erf((x_l - mean) / (SQR2 * std)))
+                    blls[k] += math.log(kernels.norm_consts[d, k] * (cdf_u - cdf_l) + EPS)
+            else:
+                for k in range(n_basis):
+                    z = (x - kernels.means[d, k]) / kernels.stds[d, k]
+                    blls[k] += kernels.logpdf_consts[d, k] - 0.5 * z * z
+
+        max_bll = blls.max()
+        log_pdf_values[i] = max_bll + math.log(np.exp(blls - max_bll).sum())
+
+    return log_pdf_values
 
 
 class TPE(BaseTPE):
@@ -19,6 +88,7 @@ class TPE(BaseTPE):
         top: float,
         minimize: Optional[Dict[str, bool]],
         quantile: float,
+        fast_math: bool = False,
     ):
         super().__init__(
             config_space=config_space,
@@ -29,19 +99,49 @@ class TPE(BaseTPE):
             min_bandwidth_factor=min_bandwidth_factor,
             top=top,
             minimize=minimize,
+            fast_math=fast_math,
         )
         self._objective_name = objective_name
         self._quantile = quantile
 
+        # The static information for _log_pdf_impl in the order of hp_names
+        n_params, params, rows = len(self._hp_names), self._numerical_params, self._numerical_rows
+        self._kernel_kinds = np.full(n_params, _CATEGORICAL_KERNEL, dtype=np.int8)
+        self._kernel_kinds[rows] = np.where(params.is_discrete, _DISCRETE_KERNEL, _CONTINUOUS_KERNEL)
+        self._categorical_index = np.full(n_params, -1, dtype=np.int64)
+        self._categorical_index[self._categorical_rows] = np.arange(len(self._categorical_rows))
+        self._lb, self._ub, self._half_q = np.zeros((3, n_params))
+        self._lb[rows], self._ub[rows] = params.lb, params.ub
+        self._half_q[rows] = np.where(params.is_discrete, 0.5 * params.q, 0.0)
+
     def _percentile_func(self) -> int:
-        n_observations = self._observations[self._objective_name].size
-        return int(np.ceil(self._quantile * n_observations))
+        return int(np.ceil(self._quantile * self._n_observations))
 
     def _calculate_order(self, results: Optional[Dict[str, float]] = None) -> np.ndarray:
-        if results is None:
-            loss_vals = self._observations[self._objective_name]
-        else:
-            loss_vals = np.append(self._observations[self._objective_name], results[0][self._objective_name])
-
-        self._order = np.argsort(loss_vals)
+        # results is always None because _store_observations inserts new observations without re-sorting
+        # _store_observations relies on the fully sorted losses, so we cannot use argpartition here
+        self._order = np.argsort(self._fetch_observations(self._objective_name))
         return self._order
+
+    def _store_observations(self, eval_config: Dict[str, NumericType], results: Dict[str, float]) -> int:
+        # The sorted losses are maintained, so we only need to shift the columns behind the insertion index
+        new_col = self._encode_observation(eval_config=eval_config, results=results)
+        size = self.size
+        self._sorted_observations = reserve_columns(self._sorted_observations, size)
+        idx = insert_and_sort(self._sorted_observations, size, new_col, self._row_of[self._objective_name])
+        self._append_observations(new_col)
+        return int(idx)
+
+    def compute_config_loglikelihoods(self, config_cands: Dict[str, np.ndarray]) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Compute the loglikelihoods of each configuration in the lower and the upper groups.
+        If numba is available, they are computed by the jitted _log_pdf_impl.
+        """
+        if not NUMBA_AVAILABLE:
+            return super().compute_config_loglikelihoods(config_cands)
+
+        X = np.asarray([config_cands[hp_name] for hp_name in self._hp_names], dtype=np.float64)
+        static_args = (self._kernel_kinds, self._categorical_index, self._lb, self._ub, self._half_q)
+        config_ll_lower = _log_pdf_impl(X, *static_args, self._mvpe_lower.kernel_arrays, self._fast_math)
+        config_ll_upper = _log_pdf_impl(X, *static_args, self._mvpe_upper.kernel_arrays, self._fast_math)
+        return config_ll_lower, config_ll_upper
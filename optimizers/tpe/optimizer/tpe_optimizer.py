@@ -6,6 +6,7 @@ import numpy as np
 
 from optimizers.tpe.optimizer.base_optimizer import BaseOptimizer, ObjectiveFunc
 from optimizers.tpe.optimizer.models import ConstraintTPE, MetaLearnTPE, MultiObjectiveTPE, TPE
+from optimizers.tpe.utils.constants import PI_IMPROVEMENT_TOL
 
 
 DEFAULT_OBJECTIVE_NAMES = ["loss"]
@@ -32,6 +33,9 @@ class TPEOptimizer(BaseOptimizer):
         warmstart_configs: Optional[Dict[str, np.ndarray]] = None,
         random_ratio: Optional[float] = 0.05,
         minimize: Optional[Dict[str, bool]] = None,
+        fast_math: bool = False,
+        ei_batch_size: Optional[int] = None,
+        ei_patience: int = 2,
         # The control parameters for experiments
         quantile: float = 0.1,
         uniform_transform: bool = False,
@@ -63,7 +67,24 @@ class TPEOptimizer(BaseOptimizer):
                 In other words, epsillon in the epsillon-greedy algorithm.
                 random_ratio of non-zero guarantees global optimization
                 while random_ratio of zero (or None) is suitable for local optimization.
+            fast_math (bool):
+                If True, the Parzen estimators use the logistic approximation of the normal cdf
+                for discrete parameters, which is quicker but less accurate.
+            ei_batch_size (Optional[int]):
+                If given, candidates are sampled and evaluated in batches of this size
+                until the best probability improvement stops improving or n_ei_candidates are evaluated.
+                It is not supported for meta-learning.
+            ei_patience (int):
+                The number of consecutive batches without the improvement of PI_IMPROVEMENT_TOL
+                before the batched sampling stops. It is used only if ei_batch_size is given.
         """
+        if metadata is not None and ei_batch_size is not None:
+            raise ValueError("ei_batch_size is not supported for meta-learning")
+        if ei_batch_size is not None and ei_batch_size < 1:
+            raise ValueError(f"ei_batch_size must be a positive integer, but got {ei_batch_size}")
+        if ei_patience < 1:
+            raise ValueError(f"ei_patience must be a positive integer, but got {ei_patience}")
+
         super().__init__(
             obj_func=obj_func,
             config_space=config_space,
@@ -81,6 +102,9 @@ class TPEOptimizer(BaseOptimizer):
         self._uniform_transform = uniform_transform
         self._dim_reduction_factor = dim_reduction_factor
         # END: The control parameters for experiments
+        self._n_ei_candidates = n_ei_candidates
+        self._ei_batch_size = ei_batch_size
+        self._ei_patience = ei_patience
 
         tpe_params = dict(
             config_space=config_space,
@@ -90,6 +114,7 @@ class TPEOptimizer(BaseOptimizer):
             min_bandwidth_factor=min_bandwidth_factor,
             top=top,
             minimize=minimize,
+            fast_math=fast_math,
         )
         self._sampler: Union[TPE, ConstraintTPE, MetaLearnTPE, MultiObjectiveTPE]
         self._warmstart_configs = warmstart_configs
@@ -166,12 +191,48 @@ class TPEOptimizer(BaseOptimizer):
         if self._rng.random() < self._random_ratio:  # random policy for the epsillon-greedy
             return self.initial_sample()
 
+        if self._ei_batch_size is not None:
+            return self._revert_eval_config(self._progressive_sample(self._ei_batch_size))
+
         config_cands = self._sampler.get_config_candidates()
         pi_config = self._compute_probability_improvement(config_cands=config_cands)
         best_idx = int(np.argmax(pi_config))
         eval_config = {hp_name: config_cands[hp_name][best_idx] for dim, hp_name in enumerate(self._hp_names)}
         return self._revert_eval_config(eval_config)
 
+    def _progressive_sample(self, batch_size: int) -> Dict[str, Any]:
+        """
+        Sample candidates batch by batch and stop once the best (log) probability improvement
+        improves by less than PI_IMPROVEMENT_TOL for ei_patience consecutive batches
+        or n_ei_candidates are evaluated.
+
+        Args:
+            batch_size (int): The number of candidates in each batch.
+
+        Returns:
+            eval_config (Dict[str, Any]): The best candidate before the reversion
+        """
+        assert isinstance(self._sampler, (TPE, MultiObjectiveTPE))  # mypy redefinition
+        eval_config: Dict[str, Any] = {}
+        best_pi, n_evaluated, n_stale = -np.inf, 0, 0
+        while n_evaluated < self._n_ei_candidates and n_stale < self._ei_patience:
+            n_samples = min(batch_size, self._n_ei_candidates - n_evaluated)
+            config_cands = self._sampler.get_config_candidates(n_samples=n_samples)
+            pi_config = self._compute_probability_improvement(config_cands=config_cands)
+            pi_config = np.where(np.isnan(pi_config), -np.inf, pi_config)
+            n_evaluated += n_samples
+
+            best_idx = int(np.argmax(pi_config))
+            improvement = pi_config[best_idx] - best_pi
+            # keep the first candidate even if no batch beats -inf, e.g. when every PI is nan
+            if improvement > 0 or len(eval_config) == 0:
+                best_pi = pi_config[best_idx]
+                eval_config = {hp_name: config_cands[hp_name][best_idx] for hp_name in self._hp_names}
+            # -inf - (-inf) is nan and counts as no improvement
+            n_stale = 0 if improvement >= PI_IMPROVEMENT_TOL else n_stale + 1
+
+        return eval_config
+
     def _warmstart_sample(self) -> Dict[str, Any]:
         idx = self._warmstart_counter
         assert self._warmstart_configs is not None  # mypy re-definition
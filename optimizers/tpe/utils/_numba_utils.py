@@ -0,0 +1,25 @@
+from typing import Any, Callable
+
+
+try:
+    from numba import njit
+
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
+    def njit(*args: Any, **kwargs: Any) -> Any:  # type: ignore[no-redef]
+        """
+        Fallback of numba.njit so that numba stays an optional dependency.
+        The decorated functions must be written such that they also run as plain NumPy code.
+        """
+        if len(args) == 1 and len(kwargs) == 0 and callable(args[0]):
+            return args[0]
+
+        def _decorator(func: Callable) -> Callable:
+            return func
+
+        return _decorator
+
+
+__all__ = ["NUMBA_AVAILABLE", "njit"]
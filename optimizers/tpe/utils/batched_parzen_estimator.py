@@ -0,0 +1,444 @@
+import copy
+from typing import Dict, List, NamedTuple, Optional, Tuple, Type
+
+import numpy as np
+
+from parzen_estimator import CategoricalParzenEstimator
+
+from optimizers.tpe.utils.constants import EPS, NumericalHPType, SQR2, SQR2PI, config2type
+from optimizers.tpe.utils.special_funcs import erf, log, logistic_ndtr, logsumexp, ndtr, ndtri
+
+
+class NumericalParameters(NamedTuple):
+    """
+    The static information of numerical parameters stacked along the first axis.
+    Each array has the shape of (n_params, ).
+
+    NOTE:
+        The bounds are in the log scale for log parameters.
+        lb and ub are extended by 0.5 * q for discrete parameters while hard_lb and hard_ub are not.
+    """
+
+    lb: np.ndarray
+    ub: np.ndarray
+    hard_lb: np.ndarray
+    hard_ub: np.ndarray
+    q: np.ndarray  # nan for continuous parameters
+    is_log: np.ndarray
+    is_discrete: np.ndarray
+    min_bandwidth_factor: np.ndarray
+    dtypes: List[Type[np.number]]
+
+
+def _get_min_bandwidth_factor(config: NumericalHPType, is_ordinal: bool, default_min_bandwidth_factor: float) -> float:
+    """
+    Return the minimum bandwidth factor of a numerical parameter.
+    It follows parzen_estimator with default_min_bandwidth_factor_for_discrete=1.0,
+    i.e. discrete parameters use the inverse of the number of grids.
+
+    Args:
+        config (NumericalHPType): Hyperparameter information from the ConfigSpace
+        is_ordinal (bool): Whether the hyperparameter is ordinal
+        default_min_bandwidth_factor (float): The minimum bandwidth for continuous parameters
+
+    Returns:
+        min_bandwidth_factor (float): The minimum bandwidth factor
+    """
+    if config.meta is not None and "min_bandwidth_factor" in config.meta:
+        return config.meta["min_bandwidth_factor"]
+    if is_ordinal:
+        return 1.0 / len(config.sequence)
+
+    dtype = config2type[config.__class__.__name__]
+    if not config.log and (config.q is not None or dtype is int):
+        q = config.q if config.q is not None else 1
+        return 1.0 / (int((config.upper - config.lower) / q) + 1)
+
+    return default_min_bandwidth_factor
+
+
+def get_numerical_parameters(
+    configs: List[NumericalHPType],
+    is_ordinals: List[bool],
+    default_min_bandwidth_factor: float,
+) -> NumericalParameters:
+    """
+    Stack the information of numerical parameters so that the Parzen estimators can be built at once.
+    The conversion follows build_numerical_parzen_estimator in parzen_estimator.
+
+    Args:
+        configs (List[NumericalHPType]): Hyperparameter information from the ConfigSpace
+        is_ordinals (List[bool]): Whether each hyperparameter is ordinal
+        default_min_bandwidth_factor (float): The minimum bandwidth for numerical parameters
+
+    Returns:
+        params (NumericalParameters): The stacked information
+    """
+    n_params = len(configs)
+    lbs, ubs, hard_lbs, hard_ubs = np.empty((4, n_params))
+    qs, min_bandwidth_factors = np.full(n_params, np.nan), np.empty(n_params)
+    is_log = np.zeros(n_params, dtype=bool)
+    dtypes: List[Type[np.number]] = []
+
+    for d, (config, is_ordinal) in enumerate(zip(configs, is_ordinals)):
+        dtype = config2type[config.__class__.__name__]
+        min_bandwidth_factors[d] = _get_min_bandwidth_factor(
+            config=config,
+            is_ordinal=is_ordinal,
+            default_min_bandwidth_factor=default_min_bandwidth_factor,
+        )
+        if is_ordinal:
+            info = config.meta
+            q, log_scale, lb, ub = info.get("q", None), info.get("log", False), info["lower"], info["upper"]
+        else:
+            q, log_scale, lb, ub = config.q, config.log, config.lower, config.upper
+
+        if dtype is int or q is not None:
+            q = None if log_scale else (1 if q is None else q)
+
+        hard_lb, hard_ub = lb, ub
+        if q is not None:
+            lb, ub = lb - 0.5 * q, ub + 0.5 * q
+        if log_scale:
+            lb, ub = np.log(lb), np.log(ub)
+            hard_lb, hard_ub = lb, ub
+            dtype = float
+
+        lbs[d], ubs[d], hard_lbs[d], hard_ubs[d] = lb, ub, hard_lb, hard_ub
+        qs[d] = np.nan if q is None else q
+        is_log[d] = log_scale
+        dtypes.append(np.int32 if dtype is int else np.float64)
+
+    return NumericalParameters(
+        lb=lbs,
+        ub=ubs,
+        hard_lb=hard_lbs,
+        hard_ub=hard_ubs,
+        q=qs,
+        is_log=is_log,
+        is_discrete=~np.isnan(qs),
+        min_bandwidth_factor=min_bandwidth_factors,
+        dtypes=dtypes,
+    )
+
+
+class BatchedNumericalParzenEstimator:
+    def __init__(self, params: NumericalParameters, means: np.ndarray, stds: np.ndarray, fast_math: bool = False):
+        """
+        Parzen estimators of numerical parameters that share the same observations.
+
+        Attributes:
+            params (NumericalParameters): The static information of each parameter
+            means (np.ndarray): The mean of each kernel. The shape is (n_params, n_basis).
+            stds (np.ndarray): The bandwidth of each kernel. The shape is (n_params, n_basis).
+            norm_consts (np.ndarray): The normalization constants due to the truncation.
+            logpdf_consts (np.ndarray): The constants for the loglikelihood computation.
+            fast_math (bool): Whether to use the logistic approximation of the normal cdf in the loglikelihood.
+        """
+        self._params = params
+        self._fast_math = fast_math
+        self._means, self._stds = means, stds
+        lb, ub = params.lb[:, np.newaxis], params.ub[:, np.newaxis]
+        zl = (lb - means) / (SQR2 * stds)
+        zu = (ub - means) / (SQR2 * stds)
+        self._norm_consts = 2.0 / (erf(zu) - erf(zl))
+        self._logpdf_consts = log(self._norm_consts / (SQR2PI * stds))
+
+    def cdf(self, X: np.ndarray, mask: np.ndarray) -> np.ndarray:
+        """
+        Compute the cumulative density function values of each kernel.
+
+        Args:
+            X (np.ndarray): The values of the masked parameters with the shape of (n_masked, n_samples)
+            mask (np.ndarray): The mask of the parameters to compute
+
+        Returns:
+            cdf (np.ndarray): The cdf values with the shape of (n_masked, n_basis, n_samples)
+        """
+        means, stds = self._means[mask, :, np.newaxis], self._stds[mask, :, np.newaxis]
+        if self._fast_math:
+            return self._norm_consts[mask, :, np.newaxis] * logistic_ndtr((X[:, np.newaxis] - means) / stds)
+
+        z = (X[:, np.newaxis] - means) / (SQR2 * stds)
+        return self._norm_consts[mask, :, np.newaxis] * 0.5 * (1.0 + erf(z))
+
+    def basis_loglikelihood(self, X: np.ndarray) -> np.ndarray:
+        """
+        Compute the kernel value for each basis in each dimension.
+
+        Args:
+            X (np.ndarray): The sampled values with the shape of (n_params, n_samples)
+
+        Returns:
+            basis_loglikelihoods (np.ndarray):
+                The kernel values with the shape of (n_params, n_basis, n_samples)
+        """
+        params = self._params
+        blls = np.empty((*self._means.shape, X.shape[-1]))
+
+        cont = ~params.is_discrete
+        if np.any(cont):
+            means, stds = self._means[cont, :, np.newaxis], self._stds[cont, :, np.newaxis]
+            mahalanobis = ((X[cont, np.newaxis] - means) / stds) ** 2
+            blls[cont] = self._logpdf_consts[cont, :, np.newaxis] - 0.5 * mahalanobis
+
+        disc = params.is_discrete
+        if np.any(disc):
+            half_q, lb, ub = 0.5 * params.q[disc, np.newaxis], params.lb[disc, np.newaxis], params.ub[disc, np.newaxis]
+            integral_u = self.cdf(np.minimum(X[disc] + half_q, ub), mask=disc)
+            integral_l = self.cdf(np.maximum(X[disc] - half_q, lb), mask=disc)
+            blls[disc] = log(integral_u - integral_l + EPS)
+
+        return blls
+
+    def sample(self, rng: np.random.Generator, n_samples: int) -> np.ndarray:
+        """
+        Sample from each Parzen estimator independently.
+        Each sample picks a kernel uniformly and draws from the truncated normal by the inverse transform sampling.
+
+        Args:
+            rng (np.random.Generator): The random number generator for numpy.
+            n_samples (int): The number of samples.
+
+        Returns:
+            samples (np.ndarray): The samples with the shape of (n_params, n_samples).
+        """
+        params = self._params
+        shape = (self._means.shape[0], n_samples)
+        indices = rng.integers(self.size, size=shape)
+        means = np.take_along_axis(self._means, indices, axis=-1)
+        stds = np.take_along_axis(self._stds, indices, axis=-1)
+        a = (params.hard_lb[:, np.newaxis] - means) / stds
+        b = (params.hard_ub[:, np.newaxis] - means) / stds
+
+        # Flip the bounds on the right of the mean so that ndtr does not lose the precision around 1
+        flip = a > 0
+        a[flip], b[flip] = -b[flip], -a[flip]
+        cdf_a, cdf_b = ndtr(a), ndtr(b)
+        z = np.clip(ndtri(cdf_a + rng.random(shape) * (cdf_b - cdf_a)), a, b)
+        z[flip] = -z[flip]
+        samples = np.clip(means + stds * z, params.hard_lb[:, np.newaxis], params.hard_ub[:, np.newaxis])
+
+        disc = params.is_discrete
+        if np.any(disc):
+            hard_lb, q = params.hard_lb[disc, np.newaxis], params.q[disc, np.newaxis]
+            samples[disc] = np.round((samples[disc] - hard_lb) / q) * q + hard_lb
+
+        return samples
+
+    def concatenate(self, other: "BatchedNumericalParzenEstimator") -> "BatchedNumericalParzenEstimator":
+        """
+        Return the estimators whose kernels are the kernels of self followed by those of other.
+        Both must share the same parameters.
+        """
+        pe = copy.copy(self)
+        pe._means = np.hstack([self._means, other._means])
+        pe._stds = np.hstack([self._stds, other._stds])
+        pe._norm_consts = np.hstack([self._norm_consts, other._norm_consts])
+        pe._logpdf_consts = np.hstack([self._logpdf_consts, other._logpdf_consts])
+        return pe
+
+    @property
+    def dtypes(self) -> List[Type[np.number]]:
+        return self._params.dtypes
+
+    @property
+    def size(self) -> int:
+        return self._means.shape[-1]
+
+
+def build_numerical_parzen_estimators(
+    params: NumericalParameters, vals: np.ndarray, fast_math: bool = False
+) -> BatchedNumericalParzenEstimator:
+    """
+    Build the Parzen estimators of numerical parameters at once based on Scott's rule.
+    Each estimator has the prior kernel at the center of the domain as in build_numerical_parzen_estimator.
+
+    Args:
+        params (NumericalParameters): The static information of each parameter
+        vals (np.ndarray): The observed values with the shape of (n_params, n_observations)
+        fast_math (bool): Whether to use the logistic approximation of the normal cdf in the loglikelihood
+
+    Returns:
+        pe (BatchedNumericalParzenEstimator): Parzen estimators given a set of observations
+    """
+    vals = vals.copy()
+    vals[params.is_log] = np.log(vals[params.is_log])
+    center = 0.5 * (params.hard_lb + params.hard_ub)
+    means = np.hstack([vals, center[:, np.newaxis]])
+
+    n_basis = means.shape[-1]
+    std = means.std(axis=-1, ddof=int(n_basis > 1))
+    IQR = np.subtract.reduce(np.percentile(means, [75, 25], axis=-1))
+    bandwidth = 1.059 * np.minimum(IQR / 1.34, std) * n_basis ** (-0.2)
+
+    domain_range = params.ub - params.lb
+    stds = np.clip(
+        np.repeat(bandwidth[:, np.newaxis], n_basis, axis=-1),
+        (params.min_bandwidth_factor * domain_range)[:, np.newaxis],
+        0.5 * domain_range[:, np.newaxis],
+    )
+    stds[:, -1] = domain_range  # The bandwidth for the prior
+    return BatchedNumericalParzenEstimator(params=params, means=means, stds=stds, fast_math=fast_math)
+
+
+class KernelArrays(NamedTuple):
+    """
+    The kernels of BatchedMultiVariateParzenEstimator for all the parameters.
+
+    Attributes:
+        means, stds, logpdf_consts, norm_consts (np.ndarray):
+            The kernel information of numerical parameters with the shape of (n_params, n_basis).
+        categorical_blls (np.ndarray):
+            The basis loglikelihoods of categorical parameters in the order of categorical_pes.
+            The shape is (n_categoricals, n_basis, max n_choices).
+        log_weight (float): The log of the (uniform) weight of each basis.
+    """
+
+    means: np.ndarray
+    stds: np.ndarray
+    logpdf_consts: np.ndarray
+    norm_consts: np.ndarray
+    categorical_blls: np.ndarray
+    log_weight: float
+
+
+class BatchedMultiVariateParzenEstimator:
+    def __init__(
+        self,
+        param_names: List[str],
+        numerical_param_names: List[str],
+        numerical_pe: Optional[BatchedNumericalParzenEstimator],
+        categorical_pes: Dict[str, CategoricalParzenEstimator],
+    ):
+        """
+        MultiVariateParzenEstimator whose numerical dimensions are batched.
+
+        Attributes:
+            param_names (List[str]): The names of all the parameters.
+            numerical_param_names (List[str]): The names of the parameters in numerical_pe.
+            numerical_pe (Optional[BatchedNumericalParzenEstimator]): The estimators of numerical parameters.
+            categorical_pes (Dict[str, CategoricalParzenEstimator]): The estimator of each categorical parameter.
+            size (int): The number of basis.
+            weights (np.ndarray): The weight values for each basis.
+            kernel_arrays (Optional[KernelArrays]): The cache of kernel_arrays.
+            paired_numerical_pe (Optional[Tuple[BatchedMultiVariateParzenEstimator, BatchedNumericalParzenEstimator]]):
+                The cache of the numerical estimator concatenated with that of the last other in log_pdf_pair.
+            cum_categorical_probs (Optional[np.ndarray]):
+                The cumulative probabilities of the choices for each categorical parameter padded by 1.
+                The shape is (n_categoricals, max n_choices).
+        """
+        self._param_names = param_names
+        self._numerical_param_names = numerical_param_names
+        self._numerical_pe = numerical_pe
+        self._categorical_pes = categorical_pes
+        self._size = numerical_pe.size if numerical_pe is not None else list(categorical_pes.values())[0].size
+        self._weights = np.full(self._size, 1.0 / self._size)
+        self._kernel_arrays: Optional[KernelArrays] = None
+        self._paired_numerical_pe: Optional[
+            Tuple["BatchedMultiVariateParzenEstimator", BatchedNumericalParzenEstimator]
+        ] = None
+        self._cum_categorical_probs: Optional[np.ndarray] = None
+        if len(categorical_pes) > 0:
+            n_choices = [pe.n_choices for pe in categorical_pes.values()]
+            cum_probs = np.ones((len(n_choices), max(n_choices)))
+            for c, pe in enumerate(categorical_pes.values()):
+                # The last choice is set to 1 so that the rounding error never selects the padded choices
+                cum_probs[c, :n_choices[c] - 1] = np.cumsum(pe._probs[:-1])
+            self._cum_categorical_probs = cum_probs
+
+    def log_pdf_pair(
+        self, other: "BatchedMultiVariateParzenEstimator", X: Dict[str, np.ndarray]
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Compute the log density values of self and other given data points X in a single pass.
+        The kernels of both estimators are evaluated together and the logsumexp is split at the boundary.
+        The concatenated numerical kernels are cached while other stays the same.
+
+        Args:
+            other (BatchedMultiVariateParzenEstimator): The estimator with the same parameters as self.
+            X (Dict[str, np.ndarray]): Data points with the shape of (n_samples, ) in each dimension.
+
+        Returns:
+            log_pdf_values, other_log_pdf_values (Tuple[np.ndarray, np.ndarray]):
+                The log density values of self and other for each data point.
+                The shape is (n_samples, ) for each.
+        """
+        n_samples = X[self._param_names[0]].size
+        blls = np.zeros((self._size + other._size, n_samples))
+        if self._numerical_pe is not None:
+            assert other._numerical_pe is not None  # mypy redefinition
+            X_numerical = np.asarray([X[param_name] for param_name in self._numerical_param_names], dtype=np.float64)
+            if self._paired_numerical_pe is None or self._paired_numerical_pe[0] is not other:
+                self._paired_numerical_pe = (other, self._numerical_pe.concatenate(other._numerical_pe))
+            blls += self._paired_numerical_pe[1].basis_loglikelihood(X_numerical).sum(axis=0)
+        for param_name, pe in self._categorical_pes.items():
+            blls[:self._size] += pe.basis_loglikelihood(X[param_name])
+            blls[self._size:] += other._categorical_pes[param_name].basis_loglikelihood(X[param_name])
+
+        return (
+            logsumexp(blls[:self._size], axis=0, weight=self._weights[0]),
+            logsumexp(blls[self._size:], axis=0, weight=other._weights[0]),
+        )
+
+    @property
+    def kernel_arrays(self) -> KernelArrays:
+        """
+        The kernels stacked in the order of param_names for the fused loglikelihood computation.
+        The rows of categorical parameters in the numerical arrays are unused.
+        """
+        if self._kernel_arrays is not None:
+            return self._kernel_arrays
+
+        n_params = len(self._param_names)
+        means, stds, logpdf_consts, norm_consts = np.ones((4, n_params, self._size))
+        if self._numerical_pe is not None:
+            rows = [self._param_names.index(param_name) for param_name in self._numerical_param_names]
+            means[rows], stds[rows] = self._numerical_pe._means, self._numerical_pe._stds
+            logpdf_consts[rows] = self._numerical_pe._logpdf_consts
+            norm_consts[rows] = self._numerical_pe._norm_consts
+
+        n_choices = [pe.n_choices for pe in self._categorical_pes.values()]
+        categorical_blls = np.zeros((len(n_choices), self._size, max(n_choices, default=0)))
+        for c, pe in enumerate(self._categorical_pes.values()):
+            categorical_blls[c, :, :n_choices[c]] = pe._basis_loglikelihoods
+
+        self._kernel_arrays = KernelArrays(
+            means=means,
+            stds=stds,
+            logpdf_consts=logpdf_consts,
+            norm_consts=norm_consts,
+            categorical_blls=categorical_blls,
+            log_weight=float(np.log(self._weights[0])),
+        )
+        return self._kernel_arrays
+
+    def sample(self, n_samples: int, rng: np.random.Generator) -> Dict[str, np.ndarray]:
+        """
+        Sample each dimension independently.
+        Numerical parameters and categorical parameters are respectively sampled at once.
+
+        Args:
+            n_samples (int): The number of samples.
+            rng (np.random.Generator): The random number generator for numpy.
+
+        Returns:
+            samples (Dict[str, np.ndarray]): The samples with the shape of (n_samples, ) in each dimension.
+        """
+        samples: Dict[str, np.ndarray] = {}
+        if self._numerical_pe is not None:
+            numerical_samples = self._numerical_pe.sample(rng, n_samples)
+            dtypes = self._numerical_pe.dtypes
+            for d, param_name in enumerate(self._numerical_param_names):
+                samples[param_name] = numerical_samples[d].astype(dtypes[d])
+        if self._cum_categorical_probs is not None:
+            cum_probs = self._cum_categorical_probs
+            uniforms = rng.random((cum_probs.shape[0], n_samples))
+            categorical_samples = (cum_probs[:, np.newaxis] > uniforms[..., np.newaxis]).argmax(axis=-1)
+            samples.update(zip(self._categorical_pes.keys(), categorical_samples))
+
+        return {param_name: samples[param_name] for param_name in self._param_names}
+
+    @property
+    def size(self) -> int:
+        return self._size
@@ -0,0 +1,37 @@
+import numpy as np
+
+from optimizers.tpe.utils._numba_utils import njit
+
+
+def reserve_columns(buf: np.ndarray, size: int) -> np.ndarray:
+    """
+    Return buf itself if it has room for one more column, otherwise a copy with the doubled capacity.
+    """
+    if size < buf.shape[1]:
+        return buf
+
+    new_buf = np.empty((buf.shape[0], max(16, 2 * buf.shape[1])), dtype=buf.dtype)
+    new_buf[:, :size] = buf[:, :size]
+    return new_buf
+
+
+@njit(cache=True)
+def insert_and_sort(buf: np.ndarray, size: int, new_col: np.ndarray, loss_row: int) -> int:
+    """
+    Insert a new column into the sorted structure of arrays while keeping buf[loss_row, :size + 1] sorted.
+
+    Args:
+        buf (np.ndarray):
+            The sorted observations with the shape of (n_rows, capacity).
+            buf[:, :size] must be sorted based on buf[loss_row] and capacity must be larger than size.
+        size (int): The number of valid columns in buf.
+        new_col (np.ndarray): The new observation with the shape of (n_rows, ).
+        loss_row (int): The row index of the loss used for the sort.
+
+    Returns:
+        idx (int): The column index where the new observation was inserted.
+    """
+    idx = np.searchsorted(buf[loss_row, :size], new_col[loss_row], side="right")
+    buf[:, idx + 1:size + 1] = buf[:, idx:size].copy()
+    buf[:, idx] = new_col
+    return idx
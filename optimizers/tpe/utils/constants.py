@@ -10,6 +10,10 @@ NumericType = Union[float, int]
 SQR2, SQR2PI = np.sqrt(2), np.sqrt(2 * np.pi)
 OBJECTIVE_KEY = "objective"
 TIE_BREAK_METHOD: Final = "crowding_distance"
+# The number of samples evaluated at once in log_pdf to bound the size of (n_dims, n_basis, n_samples) arrays
+LOG_PDF_CHUNK_SIZE: Final = 256
+# The minimum improvement of the best log probability improvement to continue sampling candidates progressively
+PI_IMPROVEMENT_TOL: Final = 1e-3
 
 CategoricalHPType = Union[CSH.CategoricalHyperparameter]
 NumericalHPType = Union[
@@ -7,6 +7,11 @@ from torch import erf as torch_erf
 from torch import exp as torch_exp
 from torch import log as torch_log
 from torch import logsumexp as torch_logsumexp
+from torch.special import ndtr as torch_ndtr
+from torch.special import ndtri as torch_ndtri
+
+
+LOGISTIC_SCALE = np.pi / np.sqrt(3)
 
 
 # torch implementation is quicker than that of numpy!
@@ -24,3 +29,20 @@ def exp(x: np.ndarray) -> np.ndarray:
 
 def erf(x: np.ndarray) -> np.ndarray:
     return torch_erf(as_tensor(x)).cpu().detach().numpy()
+
+
+def ndtr(x: np.ndarray) -> np.ndarray:
+    return torch_ndtr(as_tensor(x)).cpu().detach().numpy()
+
+
+def ndtri(x: np.ndarray) -> np.ndarray:
+    return torch_ndtri(as_tensor(x)).cpu().detach().numpy()
+
+
+def logistic_ndtr(x: np.ndarray) -> np.ndarray:
+    """
+    The logistic approximation of the cdf of the standard normal distribution, i.e. 1 / (1 + exp(-pi / sqrt(3) * x)).
+    The absolute error is at most around 0.02, but it is much cheaper than erf.
+    tanh is used so that we do not overflow for large |x|.
+    """
+    return 0.5 * (1.0 + np.tanh(0.5 * LOGISTIC_SCALE * x))
@@ -0,0 +1,116 @@
+import unittest
+
+import ConfigSpace as CS
+import ConfigSpace.hyperparameters as CSH
+
+import numpy as np
+
+from parzen_estimator import MultiVariateParzenEstimator, build_numerical_parzen_estimator
+
+from optimizers.tpe.utils.batched_parzen_estimator import (
+    BatchedMultiVariateParzenEstimator,
+    build_numerical_parzen_estimators,
+    get_numerical_parameters,
+)
+from optimizers.tpe.utils.constants import config2type
+
+
+DEFAULT_MIN_BANDWIDTH_FACTOR = 1e-2
+TOL = 1e-12
+
+
+def get_config_space() -> CS.ConfigurationSpace:
+    config_space = CS.ConfigurationSpace()
+    config_space.add_hyperparameters(
+        [
+            CSH.UniformFloatHyperparameter("float", -5, 5),
+            CSH.UniformFloatHyperparameter("log_float", 1e-3, 1, log=True),
+            CSH.UniformIntegerHyperparameter("int", -3, 10),
+            CSH.UniformIntegerHyperparameter("log_int", 1, 1000, log=True),
+            CSH.UniformFloatHyperparameter("q_float", 0, 1, q=0.25),
+            CSH.OrdinalHyperparameter("log_ordinal", sequence=[1, 2, 4, 8], meta=dict(lower=1, upper=8, log=True)),
+            CSH.OrdinalHyperparameter("q_ordinal", sequence=[0.1, 0.2, 0.3], meta=dict(lower=0.1, upper=0.3, q=0.1)),
+        ]
+    )
+    return config_space
+
+
+def sample_observations(config_space: CS.ConfigurationSpace, n_samples: int, seed: int) -> np.ndarray:
+    config_space.seed(seed)
+    configs = [config_space.sample_configuration() for _ in range(n_samples)]
+    hp_names = list(config_space._hyperparameters.keys())
+    return np.asarray([[config[hp_name] for config in configs] for hp_name in hp_names], dtype=np.float64)
+
+
+class TestBatchedParzenEstimator(unittest.TestCase):
+    def setUp(self) -> None:
+        self.config_space = get_config_space()
+        self.hp_names = list(self.config_space._hyperparameters.keys())
+        self.configs = [self.config_space.get_hyperparameter(hp_name) for hp_name in self.hp_names]
+        self.is_ordinals = [config.__class__.__name__ == "OrdinalHyperparameter" for config in self.configs]
+        self.params = get_numerical_parameters(
+            configs=self.configs,
+            is_ordinals=self.is_ordinals,
+            default_min_bandwidth_factor=DEFAULT_MIN_BANDWIDTH_FACTOR,
+        )
+
+    def _build_estimators(self, vals: np.ndarray) -> MultiVariateParzenEstimator:
+        return MultiVariateParzenEstimator(
+            {
+                hp_name: build_numerical_parzen_estimator(
+                    config=config,
+                    dtype=config2type[config.__class__.__name__],
+                    vals=vals[d],
+                    is_ordinal=is_ordinal,
+                    default_min_bandwidth_factor=DEFAULT_MIN_BANDWIDTH_FACTOR,
+                )
+                for d, (hp_name, config, is_ordinal) in enumerate(zip(self.hp_names, self.configs, self.is_ordinals))
+            }
+        )
+
+    def _build_batched_estimator(self, vals: np.ndarray) -> BatchedMultiVariateParzenEstimator:
+        return BatchedMultiVariateParzenEstimator(
+            param_names=self.hp_names,
+            numerical_param_names=self.hp_names,
+            numerical_pe=build_numerical_parzen_estimators(params=self.params, vals=vals),
+            categorical_pes={},
+        )
+
+    def test_kernels(self) -> None:
+        for n_samples in [0, 1, 5, 40]:
+            vals = sample_observations(self.config_space, n_samples=n_samples, seed=n_samples)
+            mvpe = self._build_estimators(vals)
+            batched_pe = self._build_batched_estimator(vals)._numerical_pe
+            assert batched_pe is not None
+            for d, hp_name in enumerate(self.hp_names):
+                self.assertTrue(np.allclose(mvpe._parzen_estimators[hp_name]._means, batched_pe._means[d]))
+                self.assertTrue(np.allclose(mvpe._parzen_estimators[hp_name]._stds, batched_pe._stds[d]))
+
+    def test_log_pdf_pair(self) -> None:
+        for n_lower, n_upper in [(1, 4), (5, 40)]:
+            vals_lower = sample_observations(self.config_space, n_samples=n_lower, seed=0)
+            vals_upper = sample_observations(self.config_space, n_samples=n_upper, seed=1)
+            mvpe_lower, mvpe_upper = self._build_estimators(vals_lower), self._build_estimators(vals_upper)
+            batched_lower = self._build_batched_estimator(vals_lower)
+            batched_upper = self._build_batched_estimator(vals_upper)
+
+            X = batched_upper.sample(n_samples=200, rng=np.random.default_rng(0))
+            ll_lower, ll_upper = batched_lower.log_pdf_pair(batched_upper, X)
+            self.assertTrue(np.allclose(ll_lower, mvpe_lower.log_pdf(X)))
+            self.assertTrue(np.allclose(ll_upper, mvpe_upper.log_pdf(X)))
+
+    def test_sample(self) -> None:
+        vals = sample_observations(self.config_space, n_samples=10, seed=0)
+        mvpe = self._build_estimators(vals)
+        samples = self._build_batched_estimator(vals).sample(n_samples=200, rng=np.random.default_rng(0))
+        # The samples are in the same (log-transformed) space as those of MultiVariateParzenEstimator
+        expected = mvpe.sample(n_samples=200, rng=np.random.default_rng(0), dim_independent=True, return_dict=True)
+        for d, hp_name in enumerate(self.hp_names):
+            self.assertEqual(samples[hp_name].dtype, expected[hp_name].dtype)
+            # q-rounding can exceed the bounds by the floating point error
+            self.assertTrue(np.all(self.params.hard_lb[d] - TOL <= samples[hp_name]))
+            self.assertTrue(np.all(samples[hp_name] <= self.params.hard_ub[d] + TOL))
+
+
+if __name__ == "__main__":
+    unittest.main()
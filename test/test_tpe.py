@@ -0,0 +1,164 @@
+import unittest
+from typing import Any, Dict, List, Tuple
+
+import ConfigSpace as CS
+import ConfigSpace.hyperparameters as CSH
+
+import numpy as np
+
+from optimizers.tpe.optimizer.models import TPE
+from optimizers.tpe.optimizer.models.base_tpe import BaseTPE
+from optimizers.tpe.optimizer.models.tpe import _log_pdf_impl
+from optimizers.tpe.utils._numba_utils import NUMBA_AVAILABLE
+from optimizers.tpe.utils.batched_parzen_estimator import BatchedMultiVariateParzenEstimator
+from optimizers.tpe.utils.buffer_utils import insert_and_sort
+
+
+OBJECTIVE_NAME, RUNTIME_NAME = "loss", "iter_time"
+
+
+def get_config_space() -> CS.ConfigurationSpace:
+    config_space = CS.ConfigurationSpace()
+    config_space.add_hyperparameters(
+        [
+            CSH.UniformFloatHyperparameter("float", -5, 5),
+            CSH.UniformFloatHyperparameter("log_float", 1e-3, 1, log=True),
+            CSH.UniformIntegerHyperparameter("int", -3, 10),
+            CSH.UniformIntegerHyperparameter("log_int", 1, 100, log=True),
+            CSH.UniformFloatHyperparameter("q_float", 0, 1, q=0.25),
+            CSH.OrdinalHyperparameter("ordinal", sequence=[0.1, 0.2, 0.3], meta=dict(lower=0.1, upper=0.3, q=0.1)),
+            CSH.CategoricalHyperparameter("categorical", ["a", "b", "c"]),
+            CSH.CategoricalHyperparameter("bool", [True, False]),
+        ]
+    )
+    return config_space
+
+
+def get_tpe(config_space: CS.ConfigurationSpace, quantile: float = 0.15, fast_math: bool = False) -> TPE:
+    return TPE(
+        config_space=config_space,
+        n_ei_candidates=200,
+        objective_name=OBJECTIVE_NAME,
+        runtime_name=RUNTIME_NAME,
+        seed=0,
+        min_bandwidth_factor=1e-2,
+        top=0.9,
+        minimize=None,
+        quantile=quantile,
+        fast_math=fast_math,
+    )
+
+
+def update_tpe(tpe: TPE, config_space: CS.ConfigurationSpace, loss: float) -> None:
+    eval_config = dict(config_space.sample_configuration())
+    tpe.update_observations(eval_config=eval_config, results=({OBJECTIVE_NAME: loss}, 0.0), runtime=0.0)
+
+
+@unittest.skipUnless(NUMBA_AVAILABLE, "numba is not installed")
+class TestNumbaKernels(unittest.TestCase):
+    def test_log_pdf_impl(self) -> None:
+        for fast_math in [False, True]:
+            config_space = get_config_space()
+            config_space.seed(0)
+            tpe = get_tpe(config_space, fast_math=fast_math)
+            rng = np.random.RandomState(0)
+            for _ in range(40):
+                update_tpe(tpe, config_space, loss=rng.random())
+
+            config_cands = tpe.get_config_candidates()
+            X = np.asarray([config_cands[hp_name] for hp_name in tpe._hp_names], dtype=np.float64)
+            static_args = (tpe._kernel_kinds, tpe._categorical_index, tpe._lb, tpe._ub, tpe._half_q)
+            config_ll_lower, config_ll_upper = BaseTPE.compute_config_loglikelihoods(tpe, config_cands)
+            ll_lower = _log_pdf_impl(X, *static_args, tpe._mvpe_lower.kernel_arrays, fast_math)
+            ll_upper = _log_pdf_impl(X, *static_args, tpe._mvpe_upper.kernel_arrays, fast_math)
+            self.assertTrue(np.allclose(ll_lower, config_ll_lower))
+            self.assertTrue(np.allclose(ll_upper, config_ll_upper))
+
+    def test_insert_and_sort(self) -> None:
+        rng = np.random.RandomState(0)
+        n_rows, loss_row, capacity = 3, 2, 32
+        buf = np.zeros((n_rows, capacity))
+        for size in range(capacity):
+            # Round the losses so that some of them tie
+            new_col = np.append(rng.random(n_rows - 1), np.round(rng.random(), 1))
+            expected = buf.copy()
+            expected_idx = insert_and_sort.py_func(expected, size, new_col, loss_row)
+            idx = insert_and_sort(buf, size, new_col, loss_row)
+            self.assertEqual(idx, expected_idx)
+            self.assertTrue(np.array_equal(buf[:, :size + 1], expected[:, :size + 1]))
+            self.assertTrue(np.all(np.diff(buf[loss_row, :size + 1]) >= 0))
+
+
+class TestUpdateObservations(unittest.TestCase):
+    def _assert_same_estimator(
+        self, mvpe: BatchedMultiVariateParzenEstimator, expected: BatchedMultiVariateParzenEstimator
+    ) -> None:
+        self.assertEqual(mvpe.size, expected.size)
+        for vals, expected_vals in zip(mvpe.kernel_arrays, expected.kernel_arrays):
+            self.assertTrue(np.allclose(vals, expected_vals))
+
+    def test_partial_rebuild(self) -> None:
+        config_space = get_config_space()
+        config_space.seed(0)
+        tpe = get_tpe(config_space, quantile=0.25)
+        update_parzen_estimators = tpe._update_parzen_estimators
+        branches: List[Tuple[bool, bool]] = []
+
+        def record_update_parzen_estimators(update_lower: bool = True, update_upper: bool = True) -> None:
+            branches.append((update_lower, update_upper))
+            update_parzen_estimators(update_lower=update_lower, update_upper=update_upper)
+
+        tpe._update_parzen_estimators = record_update_parzen_estimators  # type: ignore[assignment]
+        rng = np.random.RandomState(0)
+        for _ in range(30):
+            update_tpe(tpe, config_space, loss=rng.random())
+            mvpe_lower, mvpe_upper = tpe._mvpe_lower, tpe._mvpe_upper
+            update_parzen_estimators()
+            self._assert_same_estimator(mvpe_lower, tpe._mvpe_lower)
+            self._assert_same_estimator(mvpe_upper, tpe._mvpe_upper)
+
+        # upper group only, lower group only and the shift of the split
+        self.assertEqual(set(branches), {(False, True), (True, False), (True, True)})
+        self.assertGreater(branches[1:].count((True, True)), 0)
+
+
+class TestStoreObservations(unittest.TestCase):
+    def test_sorted_insertion(self) -> None:
+        config_space = get_config_space()
+        config_space.seed(0)
+        tpe = get_tpe(config_space)
+        store_observations = tpe._store_observations
+        indices: List[int] = []
+
+        def record_store_observations(eval_config: Dict[str, Any], results: Dict[str, float]) -> int:
+            idx = store_observations(eval_config=eval_config, results=results)
+            indices.append(idx)
+            return idx
+
+        tpe._store_observations = record_store_observations  # type: ignore[assignment]
+        rng = np.random.RandomState(0)
+        eval_configs: List[Dict[str, Any]] = []
+        # More than 16 observations to grow the buffers and the rounded losses tie
+        for size in range(1, 41):
+            eval_configs.append(dict(config_space.sample_configuration()))
+            loss = np.round(rng.random(), 1)
+            tpe.update_observations(eval_config=eval_configs[-1], results=({OBJECTIVE_NAME: loss}, 0.0), runtime=0.0)
+
+            order = np.argsort(tpe._fetch_observations(OBJECTIVE_NAME), kind="stable")
+            self.assertTrue(np.array_equal(tpe._sorted_observations[:, :size], tpe._obs_matrix[:-1, order]))
+            self.assertEqual(indices[-1], np.flatnonzero(order == size - 1)[0])
+
+        observations = tpe.observations
+        for hp_name in tpe._hp_names:
+            expected = np.asarray([eval_config[hp_name] for eval_config in eval_configs])
+            self.assertTrue(np.array_equal(observations[hp_name], expected))
+
+        self.assertEqual(observations["int"].dtype, np.int64)
+        self.assertEqual(observations["log_int"].dtype, np.int64)
+        self.assertEqual(observations["float"].dtype, np.float64)
+        self.assertEqual(observations["categorical"].dtype, np.asarray(["a", "b", "c"]).dtype)
+        self.assertEqual(observations["bool"].dtype, np.bool_)
+
+
+if __name__ == "__main__":
+    unittest.main()
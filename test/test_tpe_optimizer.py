@@ -0,0 +1,84 @@
+import unittest
+from typing import Any, Callable, Dict, List, Tuple
+from unittest.mock import patch
+
+import ConfigSpace as CS
+import ConfigSpace.hyperparameters as CSH
+
+import numpy as np
+
+from optimizers.tpe.optimizer import TPEOptimizer
+
+
+def obj_func(eval_config: Dict[str, Any]) -> Tuple[Dict[str, float], float]:
+    return dict(loss=eval_config["x0"] ** 2 + eval_config["x1"] ** 2), 0.0
+
+
+def get_config_space() -> CS.ConfigurationSpace:
+    config_space = CS.ConfigurationSpace()
+    config_space.add_hyperparameters([CSH.UniformFloatHyperparameter(f"x{d}", -5, 5) for d in range(2)])
+    return config_space
+
+
+def get_optimizer(**kwargs: Any) -> TPEOptimizer:
+    return TPEOptimizer(obj_func=obj_func, config_space=get_config_space(), seed=0, **kwargs)
+
+
+class TestProgressiveSample(unittest.TestCase):
+    def _progressive_sample(
+        self, opt: TPEOptimizer, batch_size: int, pi_func: Callable[[int, int], np.ndarray]
+    ) -> Tuple[Dict[str, Any], List[int]]:
+        """
+        Run _progressive_sample with the stubbed sampler.
+        The candidates of the i-th batch are (i, i, ...) and pi_func(i, n_samples) gives their PI values.
+        """
+        batch_sizes: List[int] = []
+
+        def get_config_candidates(n_samples: int) -> Dict[str, np.ndarray]:
+            batch_sizes.append(n_samples)
+            return {hp_name: np.full(n_samples, float(len(batch_sizes))) for hp_name in opt._hp_names}
+
+        def compute_probability_improvement(config_cands: Dict[str, np.ndarray]) -> np.ndarray:
+            return pi_func(len(batch_sizes), batch_sizes[-1])
+
+        with patch.object(opt._sampler, "get_config_candidates", side_effect=get_config_candidates), patch.object(
+            opt, "_compute_probability_improvement", side_effect=compute_probability_improvement
+        ):
+            eval_config = opt._progressive_sample(batch_size)
+
+        return eval_config, batch_sizes
+
+    def test_patience(self) -> None:
+        for ei_patience in [1, 3]:
+            opt = get_optimizer(n_ei_candidates=1000, ei_batch_size=10, ei_patience=ei_patience)
+            # Only the first batch improves the PI
+            eval_config, batch_sizes = self._progressive_sample(opt, 10, lambda i, n: np.zeros(n))
+            self.assertEqual(len(batch_sizes), 1 + ei_patience)
+            self.assertEqual(eval_config, {"x0": 1.0, "x1": 1.0})
+
+    def test_n_ei_candidates(self) -> None:
+        opt = get_optimizer(n_ei_candidates=100, ei_batch_size=30)
+        # Every batch improves the PI, so only n_ei_candidates stops the sampling
+        eval_config, batch_sizes = self._progressive_sample(opt, 30, lambda i, n: np.full(n, float(i)))
+        self.assertEqual(batch_sizes, [30, 30, 30, 10])
+        self.assertEqual(eval_config, {"x0": 4.0, "x1": 4.0})
+
+    def test_nan(self) -> None:
+        opt = get_optimizer(n_ei_candidates=100, ei_batch_size=10)
+        eval_config, batch_sizes = self._progressive_sample(opt, 10, lambda i, n: np.full(n, np.nan))
+        self.assertEqual(eval_config, {"x0": 1.0, "x1": 1.0})
+        self.assertLessEqual(sum(batch_sizes), 100)
+
+    def test_validation(self) -> None:
+        for kwargs in [
+            dict(ei_batch_size=0),
+            dict(ei_batch_size=-1),
+            dict(ei_batch_size=10, ei_patience=0),
+            dict(ei_batch_size=10, metadata={"task": {"x0": np.zeros(1), "x1": np.zeros(1), "loss": np.zeros(1)}}),
+        ]:
+            with self.assertRaises(ValueError):
+                get_optimizer(**kwargs)
+
+
+if __name__ == "__main__":
+    unittest.main()